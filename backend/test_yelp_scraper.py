@@ -0,0 +1,335 @@
+import asyncio
+
+from aiohttp import web
+from cachetools import TTLCache
+import httpx
+import pytest
+
+import yelp_scraper
+from yelp_scraper import YelpMenuScraper
+
+MENU_PAGE = """
+<html><body>
+<div class="menu-item">
+    <h4>Garlic Fries</h4>
+    <p class="menu-item-description">Crispy fries tossed in garlic</p>
+    <div class="menu-item-price-amount">$6.50</div>
+</div>
+<div class="menu-item">
+    <h4>Cheeseburger</h4>
+    <div class="menu-item-price-amount">$12.99</div>
+</div>
+</body></html>
+"""
+
+EXPECTED_ITEMS = [
+    {'name': 'Garlic Fries', 'description': 'Crispy fries tossed in garlic', 'price': '$6.50'},
+    {'name': 'Cheeseburger', 'description': '', 'price': '$12.99'},
+]
+
+
+@pytest.fixture
+def make_scraper(tmp_path, monkeypatch):
+    """Build scrapers that cache to a temp dir and never touch Supabase"""
+    monkeypatch.setattr(yelp_scraper, 'create_client', lambda url, key: None)
+    monkeypatch.setattr(yelp_scraper, 'MENU_CACHE_NAME', str(tmp_path / 'yelp_menu_cache'))
+    monkeypatch.setattr(yelp_scraper, 'API_CACHE_NAME', str(tmp_path / 'yelp_api_cache'))
+    return lambda: YelpMenuScraper('test-key', 'http://localhost', 'test-key')
+
+
+async def serve(body, content_type='text/html; charset=utf-8', delay=0):
+    """Serve body at /menu/test from a local server, counting the requests it gets"""
+    hits = {'count': 0}
+
+    async def handler(request):
+        hits['count'] += 1
+        await asyncio.sleep(delay)
+        return web.Response(body=body, headers={'Content-Type': content_type})
+
+    app = web.Application()
+    app.router.add_get('/menu/test', handler)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, '127.0.0.1', 0)
+    await site.start()
+    port = runner.addresses[0][1]
+    return runner, f'http://127.0.0.1:{port}/menu/test', hits
+
+
+def run_with_page(body, action, content_type='text/html; charset=utf-8', delay=0):
+    """Serve body locally, run `await action(url)` against it and return its result and the request count"""
+    async def run():
+        runner, url, hits = await serve(body, content_type, delay)
+        try:
+            return await action(url), hits['count']
+        finally:
+            await runner.cleanup()
+
+    return asyncio.run(run())
+
+
+async def scrape(scraper, url):
+    try:
+        return await scraper.scrape_menu_from_yelp(url)
+    finally:
+        await scraper.close()
+
+
+def scrape_page(make_scraper, body, content_type='text/html; charset=utf-8'):
+    """Scrape a locally served page with a fresh scraper and return the items and the request count"""
+    return run_with_page(body, lambda url: scrape(make_scraper(), url), content_type)
+
+
+def test_scrape_menu_from_local_server(make_scraper):
+    items, hits = scrape_page(make_scraper, MENU_PAGE.encode('utf-8'))
+    assert items == EXPECTED_ITEMS
+    assert hits == 1
+
+
+def test_scrape_menu_from_populated_cache(make_scraper):
+    async def scrape_twice(url):
+        first = await scrape(make_scraper(), url)
+        # A fresh scraper has empty in-process caches, so this is served from the on-disk cache
+        second = await scrape(make_scraper(), url)
+        return first, second
+
+    (first, second), hits = run_with_page(MENU_PAGE.encode('utf-8'), scrape_twice)
+    assert first == EXPECTED_ITEMS
+    assert second == EXPECTED_ITEMS
+    assert hits == 1
+
+
+@pytest.mark.parametrize('fields, expected', [
+    (
+        '<strong>Promo</strong><h4>Fries</h4><p>intro</p><p class="menu-item-description">crispy</p>',
+        {'name': 'Fries', 'description': 'crispy'},
+    ),
+    (
+        '<strong>New!</strong><h3>Fries</h3><p>crispy</p>',
+        {'name': 'Fries', 'description': 'crispy'},
+    ),
+    (
+        '<span class="item-name">Side</span><h4>Burger</h4><p>juicy</p>',
+        {'name': 'Burger', 'description': 'juicy'},
+    ),
+])
+def test_specific_field_selectors_win_over_generic_tags(make_scraper, fields, expected):
+    page = f'<div class="menu-item">{fields}<span class="menu-item-price">$4.00</span></div>'
+
+    items, _ = scrape_page(make_scraper, page.encode('utf-8'))
+    assert items == [{**expected, 'price': '$4.00'}]
+
+
+@pytest.mark.parametrize('content_type', ['text/html; charset=iso-8859-1', 'text/html; charset=utf-8'])
+def test_scrape_menu_with_non_utf8_bytes(make_scraper, content_type):
+    # Latin-1 encoded page, served both correctly labelled and mislabelled as UTF-8
+    page = """
+    <div class="menu-item">
+        <h4>Crème brûlée</h4>
+        <span class="menu-item-price">$9.00</span>
+    </div>
+    """.encode('latin-1')
+
+    items, _ = scrape_page(make_scraper, page, content_type)
+    assert len(items) == 1
+    assert items[0]['price'] == '$9.00'
+    if 'iso-8859-1' in content_type:
+        assert items[0]['name'] == 'Crème brûlée'
+    else:
+        assert items[0]['name'] == 'Cr�me br�l�e'
+
+
+@pytest.mark.parametrize('from_cache', [False, True])
+def test_rate_limit_warning_skips_cached_responses(make_scraper, caplog, from_cache):
+    response = httpx.Response(
+        200,
+        headers={'RateLimit-Remaining': '3', 'RateLimit-ResetTime': '2026-01-01T00:00:00+00:00'},
+        extensions={'from_cache': from_cache}
+    )
+
+    make_scraper()._check_rate_limit(response)
+
+    warned = any('Yelp API calls left' in record.message for record in caplog.records)
+    assert warned is not from_cache
+
+
+@pytest.mark.parametrize('price_str, expected', [
+    ('$12.99', 12.99),
+    ('$1,299.50', 1299.5),
+    ('€12.50', 12.5),
+    ('₹250', 250.0),
+    ('Market price', None),
+    ('', None),
+])
+def test_clean_price(make_scraper, price_str, expected):
+    assert make_scraper().clean_price(price_str) == expected
+
+
+def count_page_scrapes(scraper):
+    """Record every menu page the scraper actually fetches and parses"""
+    scraped = []
+    scrape_menu_page = scraper._scrape_menu_page
+
+    async def counting(url):
+        scraped.append(url)
+        return await scrape_menu_page(url)
+
+    scraper._scrape_menu_page = counting
+    return scraped
+
+
+def test_concurrent_scrapes_of_one_url_share_a_request(make_scraper):
+    async def scrape_concurrently(url):
+        scraper = make_scraper()
+        try:
+            return await asyncio.gather(*[scraper.scrape_menu_from_yelp(url) for _ in range(5)])
+        finally:
+            await scraper.close()
+
+    results, hits = run_with_page(MENU_PAGE.encode('utf-8'), scrape_concurrently, delay=0.1)
+    assert results == [EXPECTED_ITEMS] * 5
+    assert hits == 1
+
+
+def test_cancelled_caller_does_not_cancel_shared_scrape(make_scraper):
+    async def cancel_first(url):
+        scraper = make_scraper()
+        try:
+            first = asyncio.ensure_future(scraper.scrape_menu_from_yelp(url))
+            second = asyncio.ensure_future(scraper.scrape_menu_from_yelp(url))
+            await asyncio.sleep(0.05)
+            first.cancel()
+            return await second
+        finally:
+            await scraper.close()
+
+    items, hits = run_with_page(MENU_PAGE.encode('utf-8'), cancel_first, delay=0.2)
+    assert items == EXPECTED_ITEMS
+    assert hits == 1
+
+
+def test_scraped_menus_are_reused(make_scraper):
+    async def scrape_twice(url):
+        scraper = make_scraper()
+        scraped = count_page_scrapes(scraper)
+        try:
+            first = await scraper.scrape_menu_from_yelp(url)
+            second = await scraper.scrape_menu_from_yelp(url)
+            return first, second, scraped
+        finally:
+            await scraper.close()
+
+    (first, second, scraped), _ = run_with_page(MENU_PAGE.encode('utf-8'), scrape_twice)
+    assert first == second == EXPECTED_ITEMS
+    assert len(scraped) == 1
+
+
+def test_empty_menus_are_retried_after_ttl(make_scraper):
+    clock = [0.0]
+
+    async def scrape_around_ttl(url):
+        scraper = make_scraper()
+        scraper._empty_menu_cache = TTLCache(maxsize=8, ttl=yelp_scraper.EMPTY_MENU_CACHE_TTL, timer=lambda: clock[0])
+        scraped = count_page_scrapes(scraper)
+        try:
+            await scraper.scrape_menu_from_yelp(url)
+            await scraper.scrape_menu_from_yelp(url)
+            cached_scrapes = len(scraped)
+            clock[0] += yelp_scraper.EMPTY_MENU_CACHE_TTL + 1
+            await scraper.scrape_menu_from_yelp(url)
+            return cached_scrapes, len(scraped)
+        finally:
+            await scraper.close()
+
+    (cached_scrapes, total_scrapes), _ = run_with_page(b'<html><body>No menu</body></html>', scrape_around_ttl)
+    assert cached_scrapes == 1
+    assert total_scrapes == 2
+
+
+class FakeSupabase:
+    """In-memory stand-in for the Supabase tables the scraper writes to"""
+
+    def __init__(self, reject_dish=None):
+        self.tables = {'restaurant': [], 'menu': [], 'dish': []}
+        self.requests = []
+        self.reject_dish = reject_dish
+
+    def table(self, name):
+        return FakeQuery(self, name)
+
+
+class FakeQuery:
+    def __init__(self, db, name):
+        self.db = db
+        self.name = name
+        self.data = []
+
+    def select(self, columns):
+        return self
+
+    def in_(self, column, values):
+        self.data = [row for row in self.db.tables[self.name] if row[column] in values]
+        return self
+
+    def upsert(self, rows, on_conflict):
+        return self.insert(rows)
+
+    def insert(self, rows):
+        if self.name == 'dish' and any(row['name'] == self.db.reject_dish for row in rows):
+            raise RuntimeError('dish rejected')
+        self.db.requests.append(self.name)
+        table = self.db.tables[self.name]
+        # Like PostgREST, return the new rows in insertion order
+        self.data = [{**row, 'id': len(table) + i + 1} for i, row in enumerate(rows)]
+        table.extend(self.data)
+        return self
+
+    def execute(self):
+        return self
+
+
+def make_restaurant(yelp_id):
+    return yelp_scraper.Restaurant(yelp_id, 4.5, 10, '$$', yelp_id, None, None, None, 'Burgers')
+
+
+def make_menu_entry(yelp_id, *dish_names):
+    dishes = [{'name': name, 'price': '$5.00'} for name in dish_names]
+    return make_restaurant(yelp_id), [{'name': f'{yelp_id} menu'}], dishes
+
+
+def test_save_batch_pairs_menus_with_their_dishes(make_scraper):
+    scraper = make_scraper()
+    scraper.supabase = FakeSupabase()
+    scraper.supabase.tables['restaurant'].append({'id': 100, 'yelp_id': 'old'})
+    scraper.prefetch_existing_restaurants(['old', 'new'])
+
+    scraper.save_batch_to_database([
+        make_menu_entry('old', 'Fries'),
+        make_menu_entry('new', 'Burger', 'Shake'),
+    ])
+
+    tables = scraper.supabase.tables
+    assert [row['yelp_id'] for row in tables['restaurant']] == ['old', 'new']
+    new_id = tables['restaurant'][1]['id']
+    assert [(menu['name'], menu['restaurant_id']) for menu in tables['menu']] == [('old menu', 100), ('new menu', new_id)]
+    old_menu, new_menu = (menu['id'] for menu in tables['menu'])
+    assert [(dish['menu_id'], dish['name'], dish['display_order']) for dish in tables['dish']] == [
+        (old_menu, 'Fries', 0),
+        (new_menu, 'Burger', 0),
+        (new_menu, 'Shake', 1),
+    ]
+    assert scraper.supabase.requests == ['restaurant', 'menu', 'dish']
+
+
+def test_failed_batch_is_retried_one_restaurant_at_a_time(make_scraper, caplog):
+    scraper = make_scraper()
+    scraper.supabase = FakeSupabase(reject_dish='Poison')
+
+    scraper.save_batch_to_database([
+        make_menu_entry('good', 'Fries'),
+        make_menu_entry('bad', 'Poison'),
+        make_menu_entry('fine', 'Burger'),
+    ])
+
+    assert sorted(dish['name'] for dish in scraper.supabase.tables['dish']) == ['Burger', 'Fries']
+    assert any('(bad)' in record.message for record in caplog.records)
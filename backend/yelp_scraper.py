@@ -1,10 +1,18 @@
-import requests
-import time
+import asyncio
+import aiohttp
+from aiohttp_client_cache import CachedSession, SQLiteBackend
+from cachetools import LRUCache, TTLCache
+import hishel
+import httpx
+import itertools
 import logging
 from supabase import create_client, Client
-from typing import List, Dict, Optional
+from typing import List, Dict, Optional, Tuple
 from dataclasses import dataclass
-from bs4 import BeautifulSoup
+from datetime import timedelta
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+from selectolax.lexbor import LexborHTMLParser
 import re
 from urllib.parse import urlparse
 
@@ -12,6 +20,75 @@ from urllib.parse import urlparse
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+# Concurrency limits for outgoing HTTP requests
+MAX_CONCURRENT_REQUESTS = 64
+MAX_REQUESTS_PER_HOST = 16
+# Search batches fetched in parallel
+MAX_CONCURRENT_SEARCHES = 5
+# Connection pool size for each session
+POOL_SIZE = 32
+# The Yelp API is reached over HTTP/2, which multiplexes requests over a few connections
+API_MAX_CONNECTIONS = 10
+API_KEEPALIVE_EXPIRY = 60
+# Retries for rate-limited and transient server errors
+MAX_RETRIES = 3
+RETRY_BACKOFF_FACTOR = 0.5
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+# 429s get more attempts with a longer exponential backoff (1s, 2s, 4s, ...)
+RATE_LIMIT_RETRIES = 5
+# Warn when the Yelp daily quota reported in the response headers drops below this
+RATE_LIMIT_WARNING_THRESHOLD = 50
+# On-disk HTTP caches so reruns don't refetch unchanged pages or burn API quota.
+# 404s are cached for menus since "no menu page" is the common case.
+MENU_CACHE_NAME = 'yelp_menu_cache'
+MENU_CACHE_EXPIRY = timedelta(days=7)
+API_CACHE_NAME = 'yelp_api_cache'
+API_CACHE_EXPIRY = timedelta(hours=1)
+# In-process caches of scraped menus keyed by menu URL, so restaurants that map to the
+# same URL (e.g. chain branches) are fetched and parsed once. Misses expire sooner.
+MENU_RESULT_CACHE_SIZE = 1024
+EMPTY_MENU_CACHE_TTL = 3600
+# Number of yelp_ids per existence lookup against Supabase
+PREFETCH_CHUNK_SIZE = 500
+# Scraped restaurants waiting to be written, and how many are written per batch
+WRITE_QUEUE_SIZE = 128
+WRITE_BATCH_SIZE = 25
+
+# Precompiled patterns for URL slugs, prices and known cities
+_SLUG_RE = re.compile(r'[^a-z0-9]+')
+_DASH_RE = re.compile(r'-+')
+_PRICE_FIND_RE = re.compile(r'\$[\d,]+\.?\d*')
+# Known cities and their Yelp URL slugs
+_CITY_SLUG = {
+    'san ramon': 'san-ramon',
+    'dublin': 'dublin',
+    'pleasanton': 'pleasanton',
+    'livermore': 'livermore',
+    'castro valley': 'castro-valley',
+    'hayward': 'hayward',
+}
+_CITY_RE = re.compile(r'\b(' + '|'.join(re.escape(city) for city in _CITY_SLUG) + r')\b')
+
+# Union of the known menu-item layouts on a Yelp menu page, matched in a single tree walk
+_ITEM_SEL = 'div.menu-item, [data-testid="menu-item"], .menu-item-details, .menuItem, .biz-menu-item'
+# Selectors for the fields of a menu item, in priority order: the first selector with a match
+# wins, wherever that element sits in the document (so a promo <strong> can't shadow the <h3> name).
+_NAME_SELS = ('h4', '.menu-item-name', '.item-name', 'h3', 'strong')
+_DESC_SELS = ('.menu-item-details-description', '.menu-item-description', '.item-description', 'p')
+_PRICE_SELS = ('.menu-item-price-amount', '.menu-item-price', '.item-price', '.price')
+
+class _PriceDeleteTable(dict):
+    """str.translate table deleting everything but decimal digits and the decimal point, filled on demand"""
+    
+    def __missing__(self, codepoint: int) -> Optional[int]:
+        char = chr(codepoint)
+        value = codepoint if char.isdecimal() or char == '.' else None
+        self[codepoint] = value
+        return value
+
+# Translation table for clean_price; covers every code point, not just Latin-1
+_PRICE_DELETE_TABLE = _PriceDeleteTable()
+
 @dataclass
 class Restaurant:
     name: str
@@ -30,21 +107,110 @@ class YelpMenuScraper:
         self.supabase: Client = create_client(supabase_url, supabase_key)
         self.headers = {
             'Authorization': f'Bearer {yelp_api_key}',
-            'Accept': 'application/json'
+            'Accept': 'application/json',
+            'Accept-Encoding': 'gzip, br, deflate'
         }
         # Headers for web scraping
         self.scraping_headers = {
             'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
             'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,*/*;q=0.8',
             'Accept-Language': 'en-US,en;q=0.5',
-            'Accept-Encoding': 'gzip, deflate',
+            'Accept-Encoding': 'gzip, br, deflate',  # br is decoded by aiohttp via the Brotli package
             'Connection': 'keep-alive',
         }
-        
-    def search_restaurants_batch(self, location: str = "San Ramon, CA", total_limit: int = 200) -> List[Dict]:
+        # Persistent clients (one per host) so connections are kept alive between requests.
+        # Created lazily so they are bound to the running event loop.
+        self._api_client: Optional[httpx.AsyncClient] = None
+        self._scrape_session: Optional[aiohttp.ClientSession] = None
+        # yelp_id -> restaurant id for restaurants already in the database
+        self._existing_restaurants: Dict[str, int] = {}
+        # menu URL -> scraped menu items (see scrape_menu_from_yelp)
+        self._menu_cache: LRUCache = LRUCache(maxsize=MENU_RESULT_CACHE_SIZE)
+        self._empty_menu_cache: TTLCache = TTLCache(maxsize=MENU_RESULT_CACHE_SIZE, ttl=EMPTY_MENU_CACHE_TTL)
+        self._menu_requests: Dict[str, asyncio.Future] = {}
+    
+    @property
+    def api_client(self) -> httpx.AsyncClient:
+        """Disk-cached HTTP/2 client for the Yelp Fusion API"""
+        if self._api_client is None or self._api_client.is_closed:
+            limits = httpx.Limits(
+                max_connections=API_MAX_CONNECTIONS,
+                max_keepalive_connections=API_MAX_CONNECTIONS,
+                keepalive_expiry=API_KEEPALIVE_EXPIRY
+            )
+            storage = hishel.AsyncFileStorage(base_path=Path(API_CACHE_NAME), ttl=API_CACHE_EXPIRY.total_seconds())
+            self._api_client = hishel.AsyncCacheClient(
+                http2=True,
+                headers=self.headers,
+                limits=limits,
+                storage=storage,
+                controller=hishel.Controller(force_cache=True)
+            )
+        return self._api_client
+    
+    @property
+    def scrape_session(self) -> aiohttp.ClientSession:
+        """Pooled, disk-cached session for scraping Yelp web pages"""
+        if self._scrape_session is None or self._scrape_session.closed:
+            cache = SQLiteBackend(MENU_CACHE_NAME, expire_after=MENU_CACHE_EXPIRY, allowed_codes=(200, 404))
+            connector = aiohttp.TCPConnector(limit=POOL_SIZE, limit_per_host=MAX_REQUESTS_PER_HOST)
+            self._scrape_session = CachedSession(cache=cache, headers=self.scraping_headers, connector=connector)
+        return self._scrape_session
+    
+    async def close(self):
+        """Close the HTTP clients"""
+        if self._api_client is not None and not self._api_client.is_closed:
+            await self._api_client.aclose()
+        if self._scrape_session is not None and not self._scrape_session.closed:
+            await self._scrape_session.close()
+    
+    @staticmethod
+    def _retry_delay(status: int, attempt: int) -> Optional[float]:
+        """Return how long to wait before retrying a response, or None if it shouldn't be retried"""
+        if status == 429 and attempt < RATE_LIMIT_RETRIES:
+            return 2 ** attempt
+        if status in RETRY_STATUSES and status != 429 and attempt < MAX_RETRIES:
+            return RETRY_BACKOFF_FACTOR * (2 ** attempt)
+        return None
+    
+    async def _get(self, url: str, params: Optional[Dict] = None) -> Tuple[bytes, str]:
+        """GET a web page and return its body and encoding, retrying rate-limited and transient server errors"""
+        for attempt in range(max(MAX_RETRIES, RATE_LIMIT_RETRIES) + 1):
+            async with self.scrape_session.get(url, params=params) as response:
+                delay = self._retry_delay(response.status, attempt)
+                if delay is None:
+                    response.raise_for_status()
+                    # The body has to be read while the response is still open
+                    body = await response.read()
+                    return body, response.get_encoding()
+                logger.warning(f"Got {response.status} from {response.url.host}, retrying in {delay}s...")
+            await asyncio.sleep(delay)
+    
+    async def _api_get(self, url: str, params: Optional[Dict] = None) -> httpx.Response:
+        """GET a Yelp API endpoint, retrying rate-limited and transient server errors"""
+        for attempt in range(max(MAX_RETRIES, RATE_LIMIT_RETRIES) + 1):
+            response = await self.api_client.get(url, params=params)
+            self._check_rate_limit(response)
+            delay = self._retry_delay(response.status_code, attempt)
+            if delay is None:
+                response.raise_for_status()
+                return response
+            logger.warning(f"Got {response.status_code} from {response.url.host}, retrying in {delay}s...")
+            await asyncio.sleep(delay)
+    
+    def _check_rate_limit(self, response: httpx.Response):
+        """Warn when Yelp reports that the API quota is nearly used up"""
+        # Cached responses carry the quota headers from when they were fetched
+        if response.extensions.get('from_cache'):
+            return
+        remaining = response.headers.get('RateLimit-Remaining')
+        if remaining is not None and remaining.isdigit() and int(remaining) < RATE_LIMIT_WARNING_THRESHOLD:
+            reset_time = response.headers.get('RateLimit-ResetTime', 'unknown')
+            logger.warning(f"Only {remaining} Yelp API calls left until the quota resets at {reset_time}")
+    
+    async def search_restaurants_batch(self, location: str = "San Ramon, CA", total_limit: int = 200) -> List[Dict]:
         """Search for restaurants using Yelp API with batching to get more than 50 results"""
         url = "https://api.yelp.com/v3/businesses/search"
-        all_businesses = []
         
         # Calculate number of batches needed
         batch_size = 50  # Yelp API max per request
@@ -52,13 +218,13 @@ class YelpMenuScraper:
         
         logger.info(f"Starting batch search for {total_limit} restaurants in {num_batches} batches")
         
-        for batch_num in range(num_batches):
+        # Offsets are independent, so batches are fetched concurrently
+        semaphore = asyncio.Semaphore(MAX_CONCURRENT_SEARCHES)
+        
+        async def fetch_batch(batch_num: int) -> List[Dict]:
             offset = batch_num * batch_size
-            limit = min(batch_size, total_limit - len(all_businesses))
+            limit = min(batch_size, total_limit - offset)
             
-            if limit <= 0:
-                break
-                
             params = {
                 'term': 'restaurants',
                 'location': location,
@@ -68,42 +234,36 @@ class YelpMenuScraper:
             }
             
             try:
-                logger.info(f"Fetching batch {batch_num + 1}/{num_batches} (offset: {offset}, limit: {limit})")
-                
-                response = requests.get(url, headers=self.headers, params=params)
-                response.raise_for_status()
+                async with semaphore:
+                    logger.info(f"Fetching batch {batch_num + 1}/{num_batches} (offset: {offset}, limit: {limit})")
+                    response = await self._api_get(url, params)
+                    data = response.json()
                 
-                data = response.json()
                 businesses = data.get('businesses', [])
                 
                 if not businesses:
                     logger.warning(f"No businesses returned in batch {batch_num + 1}")
-                    break
-                
-                all_businesses.extend(businesses)
-                logger.info(f"Batch {batch_num + 1} returned {len(businesses)} restaurants. Total so far: {len(all_businesses)}")
-                
-                # Rate limiting between batches
-                if batch_num < num_batches - 1:  # Don't sleep after the last batch
-                    logger.info("Waiting 1 second between batches...")
-                    time.sleep(1)
+                else:
+                    logger.info(f"Batch {batch_num + 1} returned {len(businesses)} restaurants")
+                return businesses
                 
             except Exception as e:
                 logger.error(f"Error in batch {batch_num + 1}: {e}")
-                # Continue with next batch instead of failing completely
-                continue
+                # Skip this batch instead of failing completely
+                return []
+        
+        results = await asyncio.gather(*[fetch_batch(batch_num) for batch_num in range(num_batches)])
+        all_businesses = list(itertools.chain.from_iterable(results))
         
         logger.info(f"Completed batch search. Total restaurants found: {len(all_businesses)}")
         return all_businesses
     
-    def get_restaurant_details(self, business_id: str) -> Optional[Dict]:
+    async def get_restaurant_details(self, business_id: str) -> Optional[Dict]:
         """Get detailed restaurant information using Yelp API"""
         url = f"https://api.yelp.com/v3/businesses/{business_id}"
         
         try:
-            response = requests.get(url, headers=self.headers)
-            response.raise_for_status()
-            
+            response = await self._api_get(url)
             return response.json()
             
         except Exception as e:
@@ -142,106 +302,119 @@ class YelpMenuScraper:
         # Convert restaurant name to URL-friendly format
         business_name = restaurant.name.lower()
         # Replace spaces and special characters with hyphens
-        business_name = re.sub(r'[^a-z0-9]+', '-', business_name)
+        business_name = _SLUG_RE.sub('-', business_name)
         # Remove leading/trailing hyphens and multiple consecutive hyphens
-        business_name = re.sub(r'-+', '-', business_name).strip('-')
+        business_name = _DASH_RE.sub('-', business_name).strip('-')
         
         # Get location from address for URL construction
         location = "san-ramon"  # Default location
         if restaurant.address:
-            # Try to extract city from address
-            address_parts = restaurant.address.lower().split(',')
-            for part in address_parts:
-                part = part.strip()
-                if 'san ramon' in part:
-                    location = "san-ramon"
-                elif 'dublin' in part:
-                    location = "dublin"
-                elif 'pleasanton' in part:
-                    location = "pleasanton"
-                elif 'livermore' in part:
-                    location = "livermore"
-                elif 'castro valley' in part:
-                    location = "castro-valley"
-                elif 'hayward' in part:
-                    location = "hayward"
+            # Try to extract city from address; the city follows the street, so the last match wins
+            cities = _CITY_RE.findall(restaurant.address.lower())
+            if cities:
+                location = _CITY_SLUG[cities[-1]]
         
         # Construct menu URL using the proper format
         menu_url = f"https://www.yelp.com/menu/{business_name}-{location}"
         return menu_url
     
-    def scrape_menu_from_yelp(self, menu_url: str) -> List[Dict]:
-        """Scrape menu items from Yelp menu page"""
+    @staticmethod
+    def _select_first(node, selectors: Tuple[str, ...]):
+        """Return the first element matching the selectors, trying each selector in turn"""
+        for selector in selectors:
+            elem = node.css_first(selector)
+            if elem is not None:
+                return elem
+        return None
+    
+    async def scrape_menu_from_yelp(self, menu_url: str) -> List[Dict]:
+        """Scrape menu items from Yelp menu page, reusing results for URLs seen before"""
+        if menu_url in self._menu_cache:
+            return self._menu_cache[menu_url]
+        if menu_url in self._empty_menu_cache:
+            return []
+        
+        # Restaurants sharing a URL are usually processed at the same time, so share the in-flight scrape
+        request = self._menu_requests.get(menu_url)
+        if request is None:
+            request = asyncio.ensure_future(self._scrape_and_cache_menu(menu_url))
+            self._menu_requests[menu_url] = request
+        # Shielded so one cancelled caller doesn't cancel the scrape the others are waiting on
+        return await asyncio.shield(request)
+    
+    async def _scrape_and_cache_menu(self, menu_url: str) -> List[Dict]:
+        """Scrape a menu page and remember the result for later callers"""
+        try:
+            menu_items = await self._scrape_menu_page(menu_url)
+        finally:
+            del self._menu_requests[menu_url]
+        
+        if menu_items:
+            self._menu_cache[menu_url] = menu_items
+        else:
+            self._empty_menu_cache[menu_url] = True
+        return menu_items
+    
+    @staticmethod
+    def _has_matched_ancestor(node, matched: set) -> bool:
+        """Check whether any ancestor of the node is in the set of matched node ids"""
+        parent = node.parent
+        while parent is not None:
+            if parent.mem_id in matched:
+                return True
+            parent = parent.parent
+        return False
+    
+    async def _scrape_menu_page(self, menu_url: str) -> List[Dict]:
+        """Fetch and parse the menu items on a Yelp menu page"""
         try:
             logger.info(f"Attempting to scrape menu from: {menu_url}")
             
-            response = requests.get(menu_url, headers=self.scraping_headers)
-            response.raise_for_status()
+            content, encoding = await self._get(menu_url)
             
-            soup = BeautifulSoup(response.content, 'html.parser')
+            # Lexbor only copes with valid UTF-8, so pure-ASCII pages are handed over as raw bytes
+            # and anything else is decoded first, replacing invalid bytes
+            if not content.isascii():
+                content = content.decode(encoding, errors='replace')
+            tree = LexborHTMLParser(content)
             menu_items = []
             
-            # Try multiple selectors for Yelp menu items
-            selectors_to_try = [
-                'div.menu-item',
-                '[data-testid="menu-item"]',
-                '.menu-item-details',
-                '.menuItem',
-                '.biz-menu-item'
-            ]
-            
-            for selector in selectors_to_try:
-                items = soup.select(selector)
-                if items:
-                    logger.info(f"Found {len(items)} menu items using selector: {selector}")
-                    break
+            # Match all known Yelp menu item layouts at once
+            items = tree.css(_ITEM_SEL)
             
             if not items:
                 logger.warning("No menu items found with any selector")
                 return []
             
+            # Layouts can nest (e.g. .menu-item-details inside div.menu-item); keep the outermost match only
+            matched = {item.mem_id for item in items}
+            items = [item for item in items if not self._has_matched_ancestor(item, matched)]
+            
+            logger.info(f"Found {len(items)} menu items")
+            
             for item in items:
                 try:
-                    # Try different ways to extract item name
+                    # Extract item name
                     item_name = ''
-                    name_selectors = ['h4', '.menu-item-name', '.item-name', 'h3', 'strong']
-                    for name_sel in name_selectors:
-                        name_elem = item.select_one(name_sel)
-                        if name_elem:
-                            item_name = name_elem.get_text(strip=True)
-                            break
+                    name_elem = self._select_first(item, _NAME_SELS)
+                    if name_elem is not None:
+                        item_name = name_elem.text(strip=True)
                     
-                    # Try different ways to extract description
+                    # Extract description
                     description = ''
-                    desc_selectors = [
-                        '.menu-item-details-description',
-                        '.menu-item-description', 
-                        '.item-description',
-                        'p'
-                    ]
-                    for desc_sel in desc_selectors:
-                        desc_elem = item.select_one(desc_sel)
-                        if desc_elem:
-                            description = desc_elem.get_text(strip=True)
-                            break
+                    desc_elem = self._select_first(item, _DESC_SELS)
+                    if desc_elem is not None:
+                        description = desc_elem.text(strip=True)
                     
-                    # Try different ways to extract price
+                    # Extract price
                     price = ''
-                    price_selectors = [
-                        '.menu-item-price-amount',
-                        '.menu-item-price',
-                        '.item-price',
-                        '.price'
-                    ]
-                    for price_sel in price_selectors:
-                        price_elem = item.select_one(price_sel)
-                        if price_elem:
-                            price_text = price_elem.get_text(strip=True)
-                            # Extract price using regex
-                            price_match = re.search(r'\$[\d,]+\.?\d*', price_text)
-                            if price_match:
-                                price = price_match.group()
-                            break
+                    price_elem = self._select_first(item, _PRICE_SELS)
+                    if price_elem is not None:
+                        price_text = price_elem.text(strip=True)
+                        # Extract price using regex
+                        price_match = _PRICE_FIND_RE.search(price_text)
+                        if price_match:
+                            price = price_match.group()
                     
                     # Only add if we have at least name and some other info
                     if item_name and (description or price):
@@ -258,18 +431,18 @@ class YelpMenuScraper:
             logger.info(f"Successfully scraped {len(menu_items)} menu items")
             return menu_items
             
-        except requests.RequestException as e:
+        except aiohttp.ClientError as e:
             logger.error(f"Error fetching menu page {menu_url}: {e}")
             return []
         except Exception as e:
             logger.error(f"Error scraping menu from {menu_url}: {e}")
             return []
     
-    def get_menu_data(self, restaurant: Restaurant) -> Optional[tuple[List[Dict], List[Dict]]]:
+    async def get_menu_data(self, restaurant: Restaurant) -> Optional[tuple[List[Dict], List[Dict]]]:
         """Get real menu data or return None if no menu found"""
         # Try to scrape real menu
         menu_url = self.construct_menu_url(restaurant)
-        scraped_dishes = self.scrape_menu_from_yelp(menu_url)
+        scraped_dishes = await self.scrape_menu_from_yelp(menu_url)
         
         if scraped_dishes:
             logger.info(f"Found menu data for {restaurant.name}")
@@ -290,126 +463,190 @@ class YelpMenuScraper:
             return None
         
         # Remove everything except digits and decimal point
-        cleaned = re.sub(r'[^\d.]', '', price_str)
+        cleaned = price_str.translate(_PRICE_DELETE_TABLE)
         
         try:
             return float(cleaned) if cleaned else None
         except ValueError:
             return None
     
+    def prefetch_existing_restaurants(self, yelp_ids: List[str]):
+        """Load the database ids of restaurants that are already stored, in chunks"""
+        for start in range(0, len(yelp_ids), PREFETCH_CHUNK_SIZE):
+            chunk = yelp_ids[start:start + PREFETCH_CHUNK_SIZE]
+            result = self.supabase.table('restaurant').select('id,yelp_id').in_('yelp_id', chunk).execute()
+            for row in result.data:
+                self._existing_restaurants[row['yelp_id']] = row['id']
+        
+        logger.info(f"Found {len(self._existing_restaurants)} restaurants already in the database")
+    
     def save_to_database(self, restaurant: Restaurant, menus: List[Dict], dishes: List[Dict]):
         """Save restaurant, menu, and dish data to Supabase"""
+        self.save_batch_to_database([(restaurant, menus, dishes)])
+    
+    def save_batch_to_database(self, batch: List[Tuple[Restaurant, List[Dict], List[Dict]]]):
+        """Save several restaurants with their menus and dishes, falling back to one at a time on failure"""
         try:
-            # Insert restaurant
-            restaurant_data = {
-                'name': restaurant.name,
-                'rating': restaurant.rating,
-                'review_count': restaurant.review_count,
-                'price_range': restaurant.price_range,
-                'yelp_id': restaurant.yelp_id,
-                'website': restaurant.website,
-                'address': restaurant.address,
-                'phone': restaurant.phone,
-                'cuisine_type': restaurant.cuisine_type
-            }
-            
-            # Check if restaurant already exists
-            existing = self.supabase.table('restaurant').select('id').eq('yelp_id', restaurant.yelp_id).execute()
-            
-            if existing.data:
-                restaurant_id = existing.data[0]['id']
-                logger.info(f"Restaurant {restaurant.name} already exists with ID {restaurant_id}")
-            else:
-                result = self.supabase.table('restaurant').insert(restaurant_data).execute()
-                restaurant_id = result.data[0]['id']
-                logger.info(f"Inserted restaurant {restaurant.name} with ID {restaurant_id}")
-            
-            # Insert menus
-            for menu_data in menus:
-                menu_data['restaurant_id'] = restaurant_id
-                
-                menu_result = self.supabase.table('menu').insert(menu_data).execute()
-                menu_id = menu_result.data[0]['id']
-                logger.info(f"Inserted menu {menu_data['name']} with ID {menu_id}")
-                
-                # Insert dishes for this menu
-                for dish_data in dishes:
-                    # Clean the price
-                    cleaned_price = self.clean_price(dish_data.get('price', ''))
-                    
-                    dish_insert_data = {
-                        'menu_id': menu_id,
-                        'name': dish_data['name'],
-                        'description': dish_data.get('description', ''),
-                        'price': cleaned_price,
-                        'display_order': 0
-                    }
-                    
-                    self.supabase.table('dish').insert(dish_insert_data).execute()
-                
-                logger.info(f"Inserted {len(dishes)} dishes for menu {menu_data['name']}")
-                
+            self._insert_batch(batch)
         except Exception as e:
-            logger.error(f"Error saving to database: {e}")
+            if len(batch) == 1:
+                restaurant = batch[0][0]
+                logger.error(f"Error saving {restaurant.name} ({restaurant.yelp_id}) to database: {e}")
+                return
+            # Retry individually so one bad row doesn't lose the whole batch
+            logger.error(f"Error saving batch of {len(batch)} restaurants to database, retrying one at a time: {e}")
+            for restaurant, menus, dishes in batch:
+                self.save_to_database(restaurant, menus, dishes)
     
-    def collect_san_ramon_data(self, total_restaurants: int = 200):
-        """Main method to collect San Ramon restaurant data with real menu scraping only"""
-        logger.info(f"Starting San Ramon restaurant data collection for {total_restaurants} restaurants - skipping restaurants without menu data...")
+    def _insert_batch(self, batch: List[Tuple[Restaurant, List[Dict], List[Dict]]]):
+        """Insert restaurants, menus and dishes using one request per table"""
+        # Insert restaurants that aren't stored yet (see prefetch_existing_restaurants)
+        new_restaurants = {}
+        for restaurant, _, _ in batch:
+            if restaurant.yelp_id in self._existing_restaurants:
+                logger.info(f"Restaurant {restaurant.name} already exists with ID {self._existing_restaurants[restaurant.yelp_id]}")
+            else:
+                new_restaurants[restaurant.yelp_id] = {
+                    'name': restaurant.name,
+                    'rating': restaurant.rating,
+                    'review_count': restaurant.review_count,
+                    'price_range': restaurant.price_range,
+                    'yelp_id': restaurant.yelp_id,
+                    'website': restaurant.website,
+                    'address': restaurant.address,
+                    'phone': restaurant.phone,
+                    'cuisine_type': restaurant.cuisine_type
+                }
         
-        # Estimate time for user
-        estimated_minutes = (total_restaurants * 4) // 60  # Rough estimate: 4 seconds per restaurant
-        logger.info(f"Estimated completion time: ~{estimated_minutes} minutes")
+        if new_restaurants:
+            result = self.supabase.table('restaurant').upsert(list(new_restaurants.values()), on_conflict='yelp_id').execute()
+            for row in result.data:
+                self._existing_restaurants[row['yelp_id']] = row['id']
+            logger.info(f"Inserted {len(result.data)} restaurants")
         
-        # Search for restaurants using batch processing
-        businesses = self.search_restaurants_batch("San Ramon, CA", total_restaurants)
+        # Insert all menus in one request; rows come back in insertion order
+        menu_rows = []
+        menu_dishes = []
+        for restaurant, menus, dishes in batch:
+            for menu_data in menus:
+                menu_data['restaurant_id'] = self._existing_restaurants[restaurant.yelp_id]
+                menu_rows.append(menu_data)
+                menu_dishes.append(dishes)
         
-        if not businesses:
-            logger.error("No businesses found. Exiting.")
+        if not menu_rows:
             return
         
-        logger.info(f"Processing {len(businesses)} restaurants...")
+        menu_result = self.supabase.table('menu').insert(menu_rows).execute()
+        menu_ids = [row['id'] for row in menu_result.data]
+        logger.info(f"Inserted {len(menu_ids)} menus")
         
-        restaurants_processed = 0
-        restaurants_skipped = 0
+        # Insert the dishes for every menu in one request
+        dish_rows = [
+            {
+                'menu_id': menu_id,
+                'name': dish_data['name'],
+                'description': dish_data.get('description', ''),
+                'price': self.clean_price(dish_data.get('price', '')),
+                'display_order': i
+            }
+            for menu_id, dishes in zip(menu_ids, menu_dishes)
+            for i, dish_data in enumerate(dishes)
+        ]
         
-        for idx, business in enumerate(businesses):
-            logger.info(f"Processing restaurant {idx + 1}/{len(businesses)}: {business['name']}")
-            
-            # Get detailed information
-            detailed_info = self.get_restaurant_details(business['id'])
-            if detailed_info:
-                business.update(detailed_info)
-            
-            # Convert to Restaurant object
-            restaurant = self.convert_to_restaurant(business)
+        if dish_rows:
+            self.supabase.table('dish').insert(dish_rows).execute()
+        
+        logger.info(f"Inserted {len(dish_rows)} dishes")
+    
+    async def collect_san_ramon_data(self, total_restaurants: int = 200):
+        """Main method to collect San Ramon restaurant data with real menu scraping only"""
+        logger.info(f"Starting San Ramon restaurant data collection for {total_restaurants} restaurants - skipping restaurants without menu data...")
+        
+        loop = asyncio.get_running_loop()
+        # The Supabase client is blocking and not thread-safe, so all database work runs
+        # on one dedicated thread while the event loop keeps scraping
+        db_executor = ThreadPoolExecutor(max_workers=1)
+        
+        try:
+            # Search for restaurants using batch processing
+            businesses = await self.search_restaurants_batch("San Ramon, CA", total_restaurants)
             
-            # Try to get menu data
-            menu_data = self.get_menu_data(restaurant)
+            if not businesses:
+                logger.error("No businesses found. Exiting.")
+                return
             
-            if menu_data is not None:
-                # We found menu data, save to database
-                menus, dishes = menu_data
-                self.save_to_database(restaurant, menus, dishes)
-                restaurants_processed += 1
-                logger.info(f"✓ Successfully processed {restaurant.name} with menu data")
-            else:
-                # No menu data found, skip this restaurant
-                restaurants_skipped += 1
-                logger.info(f"✗ Skipped {restaurant.name} - no menu data available")
+            # Look up which restaurants are already stored in one pass
+            yelp_ids = [business['id'] for business in businesses]
+            await loop.run_in_executor(db_executor, self.prefetch_existing_restaurants, yelp_ids)
             
-            # Rate limiting - be respectful to Yelp
-            time.sleep(2)
+            logger.info(f"Processing {len(businesses)} restaurants...")
             
+            restaurants_processed = 0
+            restaurants_skipped = 0
+            restaurants_checked = 0
             # Log progress every 25 restaurants for 1000+ restaurants, every 10 for smaller batches
             progress_interval = 25 if total_restaurants >= 500 else 10
-            if (idx + 1) % progress_interval == 0:
-                percent_complete = ((idx + 1) / len(businesses)) * 100
-                logger.info(f"Progress: {idx + 1}/{len(businesses)} restaurants checked ({percent_complete:.1f}%) | {restaurants_processed} processed | {restaurants_skipped} skipped")
+            semaphore = asyncio.Semaphore(MAX_CONCURRENT_REQUESTS)
+            # Scrapers feed restaurants with menus to a single writer that saves them in batches
+            write_queue: asyncio.Queue = asyncio.Queue(maxsize=WRITE_QUEUE_SIZE)
+            
+            async def write_results():
+                batch = []
+                while True:
+                    item = await write_queue.get()
+                    if item is not None:
+                        batch.append(item)
+                    # Flush when the batch is full, or when nothing else is waiting so writes don't lag behind
+                    if batch and (item is None or len(batch) >= WRITE_BATCH_SIZE or write_queue.empty()):
+                        await loop.run_in_executor(db_executor, self.save_batch_to_database, batch)
+                        batch = []
+                    if item is None:
+                        return
+            
+            async def process(business: Dict):
+                nonlocal restaurants_processed, restaurants_skipped, restaurants_checked
+                
+                async with semaphore:
+                    logger.info(f"Processing restaurant: {business['name']}")
+                    
+                    # The search result already carries every field convert_to_restaurant reads,
+                    # so no per-restaurant details request is needed here
+                    restaurant = self.convert_to_restaurant(business)
+                    
+                    # Try to get menu data
+                    menu_data = await self.get_menu_data(restaurant)
+                
+                if menu_data is not None:
+                    # We found menu data, queue it for the database writer
+                    menus, dishes = menu_data
+                    await write_queue.put((restaurant, menus, dishes))
+                    restaurants_processed += 1
+                    logger.info(f"✓ Successfully processed {restaurant.name} with menu data")
+                else:
+                    # No menu data found, skip this restaurant
+                    restaurants_skipped += 1
+                    logger.info(f"✗ Skipped {restaurant.name} - no menu data available")
+                
+                restaurants_checked += 1
+                if restaurants_checked % progress_interval == 0:
+                    percent_complete = (restaurants_checked / len(businesses)) * 100
+                    logger.info(f"Progress: {restaurants_checked}/{len(businesses)} restaurants checked ({percent_complete:.1f}%) | {restaurants_processed} processed | {restaurants_skipped} skipped")
+            
+            writer = asyncio.create_task(write_results())
+            try:
+                await asyncio.gather(*[process(business) for business in businesses])
+            finally:
+                # Sentinel: flush what's left and stop the writer
+                await write_queue.put(None)
+                await writer
             
-        logger.info(f"Data collection completed!")
-        logger.info(f"Total restaurants checked: {len(businesses)}")
-        logger.info(f"Restaurants processed with menu data: {restaurants_processed}")
-        logger.info(f"Restaurants skipped (no menu data): {restaurants_skipped}")
+            logger.info(f"Data collection completed!")
+            logger.info(f"Total restaurants checked: {len(businesses)}")
+            logger.info(f"Restaurants processed with menu data: {restaurants_processed}")
+            logger.info(f"Restaurants skipped (no menu data): {restaurants_skipped}")
+        finally:
+            db_executor.shutdown()
+            await self.close()
 
 def main():
     # Configuration - Add your API keys here
@@ -429,7 +666,7 @@ def main():
     scraper = YelpMenuScraper(YELP_API_KEY, SUPABASE_URL, SUPABASE_KEY)
     
     # Start data collection for 1000 restaurants
-    scraper.collect_san_ramon_data(total_restaurants=1000)
+    asyncio.run(scraper.collect_san_ramon_data(total_restaurants=1000))
 
 if __name__ == "__main__":
     main()
\ No newline at end of file